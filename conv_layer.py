@@ -1,10 +1,119 @@
 #import numpy as np
 import cupy as np
+from concurrent.futures import ThreadPoolExecutor
+try:
+    from cupy import cublas
+except ImportError:
+    cublas = None
+try:
+    from cupy import cuda
+except ImportError:
+    cuda = None
+
+from optimizer import adam_update
+
+
+def gemm(a, b, out, beta=0.0):
+    """Matrix product out = a @ b + beta*out written into out. Uses cuBLAS
+    directly if available, which takes transposed views without a copy
+    and accumulates into out for beta=1, the fallback computes the product
+    into a temporary for beta=1.
+    Args:
+        a (np.array): matrix (n, k)
+        b (np.array): matrix (k, p)
+        out (np.array): output (n, p)
+        beta (float): 0 to overwrite out, 1 to accumulate into it
+    Returns:
+        np.array: out
+    """
+    if cublas is not None and a.dtype == b.dtype == out.dtype:
+        return cublas.gemm('N', 'N', a, b, out=out, beta=beta)
+    if beta == 0:
+        return np.dot(a, b, out=out)
+    out += np.dot(a, b)
+    return out
+
+
+def im2col_hwc(x_pad, f, stride, out=None):
+    """Gather the patches of a padded input into a patch-major im2col matrix.
+    Args:
+        x_pad (np.array): padded input (m, n_h_p, n_w_p, n_c)
+        f (int): filter size
+        stride (int): stride
+        out (np.array): optional output buffer (m*n_h*n_w, f*f*n_c)
+    Returns:
+        np.array: im2col matrix (m*n_h*n_w, f*f*n_c)
+    """
+    (m, n_h_p, n_w_p, n_c) = x_pad.shape
+    n_h = (n_h_p - f)//stride + 1
+    n_w = (n_w_p - f)//stride + 1
+    if out is None:
+        out = np.empty((m*n_h*n_w, f*f*n_c), dtype=x_pad.dtype)
+    cols = out.reshape(m, n_h, n_w, f, f, n_c)
+    for i in range(f):
+        for j in range(f):
+            cols[:, :, :, i, j, :] = x_pad[:, i:i+stride*n_h:stride,
+                                           j:j+stride*n_w:stride, :]
+    return out
+
+
+def col2im_add(cols, f, stride, out):
+    """Scatter-add a patch-major im2col matrix back onto a padded array.
+    Args:
+        cols (np.array): im2col matrix (m*n_h*n_w, f*f*n_c)
+        f (int): filter size
+        stride (int): stride
+        out (np.array): padded array (m, n_h_p, n_w_p, n_c), updated in place
+    Returns:
+        np.array: out
+    """
+    (m, n_h_p, n_w_p, n_c) = out.shape
+    n_h = (n_h_p - f)//stride + 1
+    n_w = (n_w_p - f)//stride + 1
+    cols = cols.reshape(m, n_h, n_w, f, f, n_c)
+    for i in range(f):
+        for j in range(f):
+            out[:, i:i+stride*n_h:stride,
+                j:j+stride*n_w:stride, :] += cols[:, :, :, i, j, :]
+    return out
+
+
+# transformation matrices of the Winograd minimal filtering F(2x2, 3x3)
+WINOGRAD_BT = np.array([[1, 0, -1, 0],
+                        [0, 1, 1, 0],
+                        [0, -1, 1, 0],
+                        [0, 1, 0, -1]], dtype=np.float32)
+WINOGRAD_G = np.array([[1, 0, 0],
+                       [0.5, 0.5, 0.5],
+                       [0.5, -0.5, 0.5],
+                       [0, 0, 1]], dtype=np.float32)
+WINOGRAD_AT = np.array([[1, 1, 1, 0],
+                        [0, 1, -1, -1]], dtype=np.float32)
 
 
 class ConvLayer:
-    def __init__(self, dim_in, f, c, stride, pad, activation='relu'):
+    def __init__(self, dim_in, f, c, stride, pad, activation='relu',
+                 dtype=np.float32, n_threads=1, tile_bytes=None,
+                 winograd=False):
         """Initialise the convolutional layer of the neural network.
+        Args:
+            dim_in (tuple): (m, n_h, n_w, n_c_prev)
+            f (int): filter size
+            c (int): number of filters
+            stride (int): stride
+            pad (int): padding
+            activation (str): activation function, 'relu' or 'none'
+            dtype (np.dtype): dtype of the parameters and buffers
+            n_threads (int): number of threads the batch is split over for the
+                im2col copies and matrix products, which release the GIL with
+                numpy, with cupy the threads only launch the kernels on the
+                current device
+            tile_bytes (int): maximal size of the im2col matrix of a tile of
+                output rows, e.g. the L2 cache size, None for the whole batch
+            winograd (bool): use the Winograd forward propagation for 3x3
+                filters with stride 1 and an even output size, which
+                transforms the whole batch at once without tiling or threads
+                and is not faster than im2col on every backend
         """
         self.dim_in = dim_in
         self.dim_out = (dim_in[0],
@@ -17,116 +126,358 @@ class ConvLayer:
         self.pad = pad
         self.activation = activation
         self.lamb = 0
-        self.X_pad = np.pad(np.zeros(dim_in), ((0, 0), (pad, pad),
-                                               (pad, pad), (0, 0)),
-                            mode='constant', constant_values=(0, 0))
-        self.Z = np.zeros(self.dim_out)
+        self.dtype = dtype
+        self.n_threads = n_threads
+        self.tile_bytes = tile_bytes
         self.W = self.__init_weights(f, c, dim_in)
-        self.b = np.zeros((1, 1, 1, c))
-        self.dX = np.zeros(dim_in)
-        self.dW = np.zeros(self.W.shape)
-        self.db = np.zeros(self.b.shape)
-        self.vW = np.zeros(self.W.shape)
-        self.vb = np.zeros(self.b.shape)
-        self.sW = np.zeros(self.W.shape)
-        self.sb = np.zeros(self.b.shape)
-        self.dZ_pad = self._allocate_dZ_pad(dim_in[0])
+        self.b = np.zeros((1, 1, 1, c), dtype=dtype)
+        self.vW = np.zeros(self.W.shape, dtype=dtype)
+        self.vb = np.zeros(self.b.shape, dtype=dtype)
+        self.sW = np.zeros(self.W.shape, dtype=dtype)
+        self.sb = np.zeros(self.b.shape, dtype=dtype)
+        self._tmpW = np.zeros(self.W.shape, dtype=dtype)
+        self._tmpb = np.zeros(self.b.shape, dtype=dtype)
+        # 1x1 layers multiply the input itself and need no im2col buffers
+        self._1x1 = f == 1 and stride == 1 and pad == 0
+        self._allocate_forward_buffers(dim_in[0], dtype)
+        self._allocate_backward_buffers(dim_in[0], dtype)
+        self._winograd = (winograd and f == 3 and stride == 1
+                          and self.dim_out[1] % 2 == 0
+                          and self.dim_out[2] % 2 == 0)
+        # specialised implementations for the shapes that allow it
+        if self._1x1:
+            self.forward = self._forward_1x1
+            self.backward = self._backward_1x1
+            self.conv_backward = self._backward_1x1
+        elif self._winograd:
+            self.forward = self._forward_winograd3x3
+
+    @property
+    def W(self):
+        """Filters of the layer (f, f, n_c_prev, n_c), assign them instead of
+        modifying them in place so that the cached transforms are dropped."""
+        return self._W
+
+    @W.setter
+    def W(self, W):
+        self._W = W
+        self._U = None
+        self._W_rot_mat = None
 
     def __init_weights(self, f, c, dim_in):
         """Initialise parameters He initialisation."""
-        return np.random.randn(f, f, dim_in[-1], c) \
+        W = np.random.randn(f, f, dim_in[-1], c) \
             * np.sqrt(2/(dim_in[1]*dim_in[2]))
+        return W.astype(self.dtype, copy=False)
 
-    def _relu(self, z):
-        """ReLu activation function
+    def _split_tiles(self, m, n_h, row_bytes):
+        """Split the output rows of a batch into tiles whose im2col matrix
+        is smaller than tile_bytes, at least one tile per thread as long as
+        there are enough output rows.
         Args:
-            z (np.array): input
+            m (int): batch size
+            n_h (int): number of output rows per image
+            row_bytes (int): size of the im2col matrix of one output row
         Returns:
-            np.array.
+            list: tiles (i_s, i_e, h_s, h_e) of images and output rows
         """
-        return np.maximum(0, z)
+        if self.tile_bytes is None:
+            rows = m*n_h
+        else:
+            rows = max(1, self.tile_bytes//row_bytes)
+        if rows >= n_h and m >= self.n_threads:
+            # whole images, split evenly into at least n_threads tiles
+            n = max(self.n_threads, -(-m//(rows//n_h)))
+            return [(m*k//n, m*(k+1)//n, 0, n_h) for k in range(n)]
+        # blocks of rows, small enough to give every thread a tile if there
+        # are fewer images than threads
+        rows = min(rows, max(1, n_h*m//self.n_threads))
+        return [(i, i+1, h, min(h+rows, n_h))
+                for i in range(m) for h in range(0, n_h, rows)]
+
+    def _tile_buffers(self, tiles, n_w, n_cols, dtype):
+        """Allocate one im2col buffer for the largest tile per thread."""
+        n_rows = max((i_e-i_s)*(h_e-h_s) for (i_s, i_e, h_s, h_e) in tiles)
+        return [np.zeros((n_rows*n_w, n_cols), dtype=dtype)
+                for _ in range(min(self.n_threads, len(tiles)))]
+
+    def _allocate_forward_buffers(self, m, dtype):
+        """Allocate memory for the padded input values, the im2col
+        buffers, Z and the ReLU mask of the forward propagation. Without
+        padding the input itself is used instead of X_pad."""
+        (_, n_h, n_w, n_c) = self.dim_out
+        n_cols = self.f*self.f*self.dim_in[3]
+        self.X_pad = None
+        if self.pad != 0:
+            self.X_pad = np.zeros((m, self.dim_in[1] + 2*self.pad,
+                                   self.dim_in[2] + 2*self.pad,
+                                   self.dim_in[3]), dtype=dtype)
+        self._L_valid = False
+        self.Z = np.zeros((m, n_h, n_w, n_c), dtype=dtype)
+        self._relu_mask = np.zeros((m, n_h, n_w, n_c), dtype=bool)
+        if self._1x1:
+            return
+        self._tiles = self._split_tiles(
+            m, n_h, n_w*n_cols*np.dtype(dtype).itemsize)
+        self._L = self._tile_buffers(self._tiles, n_w, n_cols, dtype)
+
+    def _allocate_backward_buffers(self, m, dtype):
+        """Allocate memory for dZ, the padded dZ values and the im2col buffers
+        of the transposed convolution, the gradients and the padded dX of
+        conv_backward, 1x1 layers only need dZ and the gradients."""
+        (_, n_h, n_w, n_c) = self.dim_out
+        (_, n_h_prev, n_w_prev, n_c_prev) = self.dim_in
+        n_cols = self.f*self.f*n_c
+        in_h = n_h_prev + (self.f-1)
+        in_w = n_w_prev + (self.f-1)
+        self._dZ = np.zeros((m, n_h, n_w, n_c), dtype=dtype)
+        self.dX = np.zeros((m, n_h_prev, n_w_prev, n_c_prev), dtype=dtype)
+        self.dW = np.zeros(self.W.shape, dtype=dtype)
+        self.db = np.zeros(self.b.shape, dtype=dtype)
+        if self._1x1:
+            return
+        self.dZ_pad = np.zeros((m, in_h, in_w, n_c), dtype=dtype)
+        # dZ is only ever written at these positions, so the cells in between
+        # the strides and in the padding keep the zeros of the allocation,
+        # kept as slices since pickle would detach a view from dZ_pad
+        pad_dZ = self.f-(self.pad+1)
+        self._dZ_pad_slices = (slice(None),
+                               slice(pad_dZ, in_h-pad_dZ, self.stride),
+                               slice(pad_dZ, in_w-pad_dZ, self.stride),
+                               slice(None))
+        self._tiles_dZ = self._split_tiles(
+            m, n_h_prev, n_w_prev*n_cols*np.dtype(dtype).itemsize)
+        self._L_dZ = self._tile_buffers(self._tiles_dZ, n_w_prev, n_cols, dtype)
+        # partial sums of dW per thread, a single buffer accumulates into dW
+        self._dW_parts = None
+        if len(self._L) > 1:
+            self._dW_parts = np.zeros(
+                (len(self._L), self.f*self.f*n_c_prev, n_c), dtype=dtype)
+        # col2im matrix of conv_backward, allocated on its first call
+        self._dX_col = None
+        self._dX_pad = np.zeros((m, n_h_prev + 2*self.pad,
+                                 n_w_prev + 2*self.pad, n_c_prev),
+                                dtype=dtype)
+
+    def _map(self, fn, n):
+        """Apply fn(k) for k in range(n), in parallel threads if n > 1. The
+        current cupy device is per thread, so the workers switch to the
+        device of the calling thread."""
+        if n == 1:
+            fn(0)
+            return
+        if cuda is not None:
+            device_id = cuda.Device().id
 
-    def _deriv_relu(self, z):
-        """Derivative of ReLu function
+            def work(k):
+                with cuda.Device(device_id):
+                    fn(k)
+        else:
+            work = fn
+        # the executor is not kept on the layer, so the layer stays picklable
+        with ThreadPoolExecutor(n) as executor:
+            futures = [executor.submit(work, k) for k in range(n)]
+            for future in futures:
+                future.result()
+
+    def _conv_gemm(self, x_pad, stride, W_mat, out, tiles, bufs):
+        """Compute the convolution im2col(x_pad) @ W_mat tile by tile, the
+        k-th thread uses the k-th im2col buffer for every len(bufs)-th tile.
         Args:
-            z (np.array): input values
-        Returns:
-            np.array: derivative at z.
+            x_pad (np.array): padded input (m, n_h_p, n_w_p, n_c_prev)
+            stride (int): stride
+            W_mat (np.array): filters (f*f*n_c_prev, n_c)
+            out (np.array): output (m, n_h, n_w, n_c)
+            tiles (list): tiles of the output rows
+            bufs (list): im2col buffers
         """
-        return (z > 0).astype(np.float32)
+        n_w = out.shape[2]
 
-    def _allocate_dZ_pad(self, m):
-        """Allocate memory for the padded dZ values for
-        the transposed convolution in the backpropagation."""
-        in_h = self.dim_in[1] + (self.W.shape[0]-1)
-        in_w = self.dim_in[2] + (self.W.shape[0]-1)
-        dZ_pad = np.zeros((m, in_h,
-                           in_w, self.Z.shape[-1]))
-        return dZ_pad
+        def work(k):
+            for (i_s, i_e, h_s, h_e) in tiles[k::len(bufs)]:
+                rows = (i_e-i_s)*(h_e-h_s)*n_w
+                x = x_pad[i_s:i_e, h_s*stride:(h_e-1)*stride+self.f]
+                L = im2col_hwc(x, self.f, stride, out=bufs[k][:rows])
+                gemm(L, W_mat, out[i_s:i_e, h_s:h_e].reshape(rows, -1))
 
-    def forward(self, X):
-        """Forward propagation
+        self._map(work, len(bufs))
+
+    def _conv_dW(self, dZ):
+        """Compute dW = im2col(X_pad)^T @ dZ tile by tile, the im2col
+        matrix of the forward propagation is reused if every buffer still
+        holds the patches of its tile.
         Args:
-            x (np.array): array of dimension dim_in (m, n_h_p, n_w_p, n_c_p)
-        Returns:
-            np.array: output.
+            dZ (np.array): gradient of Z (m, n_h, n_w, n_c)
         """
-        n_h = int((X.shape[1] - self.f + 2*self.pad) / self.stride) + 1
-        n_w = int((X.shape[2] - self.f + 2*self.pad) / self.stride) + 1
+        n_w = dZ.shape[2]
+        n_c = dZ.shape[3]
+        n_bufs = len(self._L)
+        if n_bufs == 1:
+            parts = [self.dW.reshape(-1, n_c)]
+        else:
+            parts = self._dW_parts
 
-        if X.shape != self.dim_in:
-            self.X_pad = np.pad(np.zeros(X.shape), ((0, 0), (self.pad, self.pad),
-                                                    (self.pad, self.pad), (0, 0)),
-                                mode='constant', constant_values=(0, 0))
+        def work(k):
+            for j, (i_s, i_e, h_s, h_e) in enumerate(self._tiles[k::n_bufs]):
+                rows = (i_e-i_s)*(h_e-h_s)*n_w
+                if self._L_valid:
+                    L = self._L[k][:rows]
+                else:
+                    x = self.X_pad[i_s:i_e, h_s*self.stride:
+                                   (h_e-1)*self.stride+self.f]
+                    L = im2col_hwc(x, self.f, self.stride,
+                                   out=self._L[k][:rows])
+                dZ_mat = dZ[i_s:i_e, h_s:h_e].reshape(rows, n_c)
+                # overwrite the partial sum for the first tile of the thread
+                gemm(L.T, dZ_mat, parts[k], beta=0.0 if j == 0 else 1.0)
+
+        self._map(work, n_bufs)
+        if n_bufs > 1:
+            np.sum(self._dW_parts, axis=0, out=self.dW.reshape(-1, n_c))
+
+    def _pad_input(self, X):
+        """Copy the input into the padded input buffer."""
+        dtype = np.result_type(X.dtype, self.W.dtype)
+        if X.shape[0] != self.Z.shape[0] or dtype != self.Z.dtype:
+            self._allocate_forward_buffers(X.shape[0], dtype)
         if self.pad != 0:
             self.X_pad[:, self.pad:-self.pad, self.pad:-self.pad, :] = X
         else:
             self.X_pad = X
 
-        # compute Z for multiple input images and multiple filters
-        shape = (self.f, self.f, self.dim_in[-1], X.shape[0], n_h, n_w, 1)
-        strides = (self.X_pad.strides * 2)[1:]
-        strides = (*strides[:-3], strides[-3]*self.stride,
-                   strides[-2]*self.stride, strides[-1])
-        M = np.lib.stride_tricks.as_strided(
-            self.X_pad, shape=shape, strides=strides)  # , writeable=False)
-        self.Z = np.tensordot(M, self.W, axes=(
-            [0, 1, 2], [0, 1, 2]))[:, :, :, 0, :]
-        #self.Z = np.einsum('pqrs,pqrtbmn->tbms', self.W, M, optimize='optimal')
-        self.Z = self.Z + self.b
+    def _activate(self):
+        """Add the bias to Z and apply the activation function in place, so
+        that Z holds the output values and not the pre-activation values."""
+        self.Z += self.b
         if self.activation == 'relu':
-            return self._relu(self.Z)
+            np.greater(self.Z, 0, out=self._relu_mask)
+            return np.multiply(self.Z, self._relu_mask, out=self.Z)
         elif self.activation == 'none':
             return self.Z
 
+    def forward(self, X):
+        """Forward propagation
+        Args:
+            x (np.array): array of dimension dim_in (m, n_h_p, n_w_p, n_c_p),
+                kept by reference for pad == 0, so it must not be modified
+                before the backward propagation
+        Returns:
+            np.array: output, the Z buffer of the layer, which is overwritten
+                by the next forward propagation, copy it to keep it.
+        """
+        self._pad_input(X)
+
+        # im2col: gather the patches into (m*n_h*n_w, f*f*n_c_prev) matrices
+        # of a tile of output rows, so that the convolution becomes a matrix
+        # product per tile, the patches are kept for the computation of dW in
+        # the backpropagation if there is only one tile per buffer
+        n_c = self.Z.shape[-1]
+        self._conv_gemm(self.X_pad, self.stride, self.W.reshape(-1, n_c),
+                        self.Z, self._tiles, self._L)
+        self._L_valid = len(self._tiles) == len(self._L)
+        return self._activate()
+
+    def _forward_1x1(self, X):
+        """Forward propagation for 1x1 filters with stride 1 and no padding,
+        the input itself is the im2col matrix.
+        Args:
+            x (np.array): array of dimension dim_in (m, n_h_p, n_w_p, n_c_p)
+        Returns:
+            np.array: output, the Z buffer of the layer, which is overwritten
+                by the next forward propagation, copy it to keep it.
+        """
+        self._pad_input(X)
+        n_c = self.Z.shape[-1]
+        gemm(X.reshape(-1, X.shape[-1]), self.W.reshape(-1, n_c),
+             self.Z.reshape(-1, n_c))
+        return self._activate()
+
+    def _forward_winograd3x3(self, X):
+        """Forward propagation for 3x3 filters with stride 1 using the
+        Winograd minimal filtering F(2x2, 3x3), used if enabled and n_h and
+        n_w are even. The transformed input tiles of the whole batch are
+        materialised at once, about 4 times the size of the input, so
+        tile_bytes and n_threads do not apply.
+        Args:
+            x (np.array): array of dimension dim_in (m, n_h_p, n_w_p, n_c_p)
+        Returns:
+            np.array: output, the Z buffer of the layer, which is overwritten
+                by the next forward propagation, copy it to keep it.
+        """
+        self._pad_input(X)
+        self._L_valid = False
+        (m, n_h, n_w, n_c) = self.Z.shape
+        n_c_prev = self.dim_in[-1]
+        t_h = n_h//2
+        t_w = n_w//2
+        if self._U is None:
+            # transformed filters G g G^T, (4*4, n_c_prev, n_c)
+            U = np.tensordot(WINOGRAD_G, self.W, axes=(1, 0))
+            U = np.tensordot(WINOGRAD_G, U, axes=(1, 1))
+            self._U = U.reshape(16, n_c_prev, n_c)
+
+        # overlapping 4x4 input tiles with stride 2, (m, t_h, t_w, 4, 4, n_c_prev)
+        shape = (m, t_h, t_w, 4, 4, n_c_prev)
+        strides = (self.X_pad.strides[0],
+                   self.X_pad.strides[1]*2,
+                   self.X_pad.strides[2]*2,
+                   self.X_pad.strides[1],
+                   self.X_pad.strides[2],
+                   self.X_pad.strides[3])
+        d = np.lib.stride_tricks.as_strided(
+            self.X_pad, shape=shape, strides=strides)  # , writeable=False)
+        # transformed input tiles B^T d B, (4*4, m*t_h*t_w, n_c_prev)
+        V = np.tensordot(WINOGRAD_BT, d, axes=(1, 3))
+        V = np.tensordot(WINOGRAD_BT, V, axes=(1, 4))
+        V = V.reshape(16, m*t_h*t_w, n_c_prev)
+        # one matrix product per tile element, (4, 4, m*t_h*t_w, n_c)
+        M = np.matmul(V, self._U).reshape(4, 4, m*t_h*t_w, n_c)
+        # output tiles A^T M A, (2, 2, m, t_h, t_w, n_c)
+        Y = np.tensordot(WINOGRAD_AT, M, axes=(1, 1))
+        Y = np.tensordot(WINOGRAD_AT, Y, axes=(1, 1))
+        Y = Y.reshape(2, 2, m, t_h, t_w, n_c)
+        self.Z.reshape(m, t_h, 2, t_w, 2, n_c)[:, :, :, :, :, :] = \
+            Y.transpose(2, 3, 1, 4, 0, 5)
+        return self._activate()
+
+    def _compute_dZ(self, dA):
+        """Gradient of Z from the gradient of the output values, cast to the
+        dtype of the forward propagation."""
+        if len(dA.shape) == 2:
+            dA = dA.reshape(dA.shape[1], *self.dim_out[1:])
+        dtype = self.Z.dtype
+        if dA.shape[0] != self._dZ.shape[0] or dtype != self._dZ.dtype:
+            self._allocate_backward_buffers(dA.shape[0], dtype)
+        if self.activation == 'relu':
+            return np.multiply(dA, self._relu_mask, out=self._dZ)
+        elif self.activation == 'none':
+            self._dZ[:, :, :, :] = dA
+            return self._dZ
+
     def conv_backward(self, dA):
-        """Naive backward propagation implementation
+        """Backward propagation implementation using im2col and col2im
         Args:
             dA (np.array): gradient of output values
         Returns:
             np.array: dX gradient of input values
         """
-        self.dW[:, :, :, :] = 0
-        self.db[:, :, :, :] = 0
-        (m, n_h, n_w, n_c) = dA.shape
-        dx_pad = np.pad(self.dX, ((0, 0), (self.pad, self.pad), (self.pad, self.pad),
-                                  (0, 0)), mode='constant', constant_values=(0, 0))
-        dZ = dA * self._deriv_relu(self.Z)
-        for h in range(n_h):
-            v_s = h*self.stride
-            v_e = h*self.stride + self.f
-            for w in range(n_w):
-                h_s = w*self.stride
-                h_e = w*self.stride + self.f
-                for c in range(n_c):
-                    dx_pad[:, v_s:v_e, h_s:h_e, :] += self.W[:, :, :, c] \
-                        * dZ[:, h, w, c].reshape(dZ.shape[0], 1, 1, 1)
-                    self.dW[:, :, :, c] += np.sum(self.X_pad[:, v_s:v_e, h_s:h_e]
-                                                  * dZ[:, h, w, c].reshape(dZ.shape[0], 1, 1, 1),
-                                                  axis=0)
-                    self.db[:, :, :, c] += np.sum(dZ[:, h, w, c])
-        self.dX[:, :, :, :] = dx_pad[:, self.pad:-
-                                     self.pad, self.pad:-self.pad, :]
+        dZ = self._compute_dZ(dA)
+        (m, n_h, n_w, n_c) = dZ.shape
+        (f, f, n_c_prev, n_c) = self.W.shape
+        dZ_mat = dZ.reshape(m*n_h*n_w, n_c)
+
+        self._conv_dW(dZ)
+        np.sum(dZ, axis=(0, 1, 2), out=self.db[0, 0, 0])
+
+        # col2im: scatter-add the patch gradients back onto the padded input
+        if self._dX_col is None:
+            self._dX_col = np.zeros((m*n_h*n_w, f*f*n_c_prev),
+                                    dtype=self._dZ.dtype)
+        dX_col = gemm(dZ_mat, self.W.reshape(-1, n_c).T, self._dX_col)
+        self._dX_pad[:, :, :, :] = 0
+        dx_pad = col2im_add(dX_col, f, self.stride, self._dX_pad)
+        self.dX[:, :, :, :] = dx_pad[:, self.pad:self.pad+self.dim_in[1],
+                                     self.pad:self.pad+self.dim_in[2], :]
 
         self.dW += self.lamb/self.dim_in[0]*self.W
 
@@ -139,70 +490,52 @@ class ConvLayer:
         Returns:
             np.array: dX gradient of input values
         """
-        if len(dA.shape) == 2:
-            dZ = dA.reshape(dA.shape[1], *self.dim_out[1:]
-                            ) * self._deriv_relu(self.Z)
-        else:
-            dZ = dA * self._deriv_relu(self.Z)
-        if dZ.shape[0] != self.dZ_pad.shape[0]:
-            self.dZ_pad = self._allocate_dZ_pad(dZ.shape[0])
-        self.dW[:, :, :, :] = 0
-        self.db[:, :, :, :] = 0
+        dZ = self._compute_dZ(dA)
         (m, n_H_prev, n_W_prev, n_C_prev) = self.dim_in
         (f, f, n_C_prev, n_C) = self.W.shape
-        stride = self.stride
         (m, n_H, n_W, n_C) = dZ.shape
-        W_rot = np.rot90(self.W, 2)
-        pad_dZ = self.W.shape[0]-(self.pad+1)
-        if pad_dZ == 0:
-            self.dZ_pad[:, 0::stride, 0::stride] = dZ
-        else:
-            self.dZ_pad[:, pad_dZ:-pad_dZ:stride,
-                        pad_dZ:-pad_dZ:stride, :] = dZ
-
-        shape = (self.dZ_pad.shape[0],                       # m
-                 self.dZ_pad.shape[1] - W_rot.shape[0] + 1,  # X_nx
-                 self.dZ_pad.shape[2] - W_rot.shape[1] + 1,  # X_ny
-                 self.dZ_pad.shape[3],                       # dZ_nc
-                 W_rot.shape[0],                             # f
-                 W_rot.shape[1])                             # f
-        strides = (self.dZ_pad.strides[0],
-                   self.dZ_pad.strides[1],
-                   self.dZ_pad.strides[2],
-                   self.dZ_pad.strides[3],
-                   self.dZ_pad.strides[1],
-                   self.dZ_pad.strides[2])
-        M = np.lib.stride_tricks.as_strided(
-            self.dZ_pad, shape=shape, strides=strides)  # , writeable=False,)
-        self.dX = np.tensordot(M, W_rot, axes=(
-            (4, 5, 3), (0, 1, 3)))
-        #self.dX = np.einsum('pqrs,bmnspq->bmnr', W_rot, M)
-
-        shape_Z = (f, f, n_C_prev, m, n_H, n_W)
-        strides_Z = (self.X_pad.strides)[1:] + (self.X_pad.strides)[0:3]
-        strides_Z = (*strides_Z[:-2], strides_Z[-2]
-                     * stride, strides_Z[-1]*stride)
-
-        M = np.lib.stride_tricks.as_strided(
-            self.X_pad, shape=shape_Z, strides=strides_Z)  # , writeable=False)
-        # self.dW = np.einsum('abcd,pqsabc->pqsd', dZ, M)
-        self.dW = np.tensordot(M, dZ, axes=((3, 4, 5), (0, 1, 2)))
+        self.dZ_pad[self._dZ_pad_slices] = dZ
+
+        # transposed convolution: im2col of dZ_pad, (m*n_H_prev*n_W_prev, f*f*n_C)
+        if self._W_rot_mat is None:
+            # the roles of the channels are swapped: (f*f*n_C, n_C_prev)
+            W_rot = np.rot90(self.W, 2).transpose(0, 1, 3, 2)
+            self._W_rot_mat = np.ascontiguousarray(W_rot).reshape(-1, n_C_prev)
+        self._conv_gemm(self.dZ_pad, 1, self._W_rot_mat, self.dX,
+                        self._tiles_dZ, self._L_dZ)
+
+        self._conv_dW(dZ)
         self.dW += self.lamb/self.dim_in[0]*self.W
 
-        # self.db = np.einsum('abcd->d', dZ).reshape(1, 1, 1, n_C)
-        self.db = np.sum(dZ, axis=(0, 1, 2)).reshape(1, 1, 1, n_C)
+        np.sum(dZ, axis=(0, 1, 2), out=self.db[0, 0, 0])
+
+        return self.dX
+
+    def _backward_1x1(self, dA):
+        """Backward propagation for 1x1 filters with stride 1 and no padding.
+        Args:
+            dA (np.array): gradient of output values
+        Returns:
+            np.array: dX gradient of input values
+        """
+        dZ = self._compute_dZ(dA)
+        (m, n_H, n_W, n_C) = dZ.shape
+        n_C_prev = self.dim_in[-1]
+        W_mat = self.W.reshape(n_C_prev, n_C)
+        dZ_mat = dZ.reshape(-1, n_C)
+        gemm(dZ_mat, W_mat.T, self.dX.reshape(-1, n_C_prev))
+        gemm(self.X_pad.reshape(-1, n_C_prev).T, dZ_mat,
+             self.dW.reshape(n_C_prev, n_C))
+        self.dW += self.lamb/self.dim_in[0]*self.W
+        np.sum(dZ, axis=(0, 1, 2), out=self.db[0, 0, 0])
 
         return self.dX
 
     def update_parameters(self, rate, t, beta1=0.9, beta2=0.999, epsilon=1e-8):
         """Update parameters"""
-        self.vW = beta1*self.vW + (1-beta1)*self.dW
-        self.vb = beta1*self.vb + (1-beta1)*self.db
-        self.sW = beta2*self.sW + (1-beta2)*self.dW**2
-        self.sb = beta2*self.sb + (1-beta2)*self.db**2
-        vW = self.vW / (1-beta1**t)
-        vb = self.vb / (1-beta1**t)
-        sW = self.sW / (1-beta2**t)
-        sb = self.sb / (1-beta2**t)
-        self.W -= rate * vW/(np.sqrt(sW)+epsilon)
-        self.b -= rate * vb/(np.sqrt(sb)+epsilon)
+        adam_update(self.W, self.dW, self.vW, self.sW, self._tmpW,
+                    rate, t, beta1, beta2, epsilon)
+        adam_update(self.b, self.db, self.vb, self.sb, self._tmpb,
+                    rate, t, beta1, beta2, epsilon)
+        self._U = None
+        self._W_rot_mat = None
@@ -1,6 +1,8 @@
 import cupy as np
 # import numpy as np
 
+from optimizer import adam_update
+
 
 class FCLayer:
     def __init__(self, dim_in, dim_out, activation='relu'):
@@ -25,6 +27,8 @@ class FCLayer:
         self.vb = np.zeros(self.b.shape)
         self.sW = np.zeros(self.W.shape)
         self.sb = np.zeros(self.b.shape)
+        self._tmpW = np.zeros(self.W.shape)
+        self._tmpb = np.zeros(self.b.shape)
 
     def _init_weights(self, dim_in, dim_out):
         """Initialise parameters with He initialisation.
@@ -44,16 +48,16 @@ class FCLayer:
         Returns:
             np.array.
         """
-        return np.maximum(0, z)
+        return z * (z > 0)
 
     def _deriv_relu(self, z):
         """Derivative of ReLu function
         Args:
             z (np.array): input values
         Returns:
-            np.array: derivative at z.
+            np.array: derivative at z as a boolean mask.
         """
-        return (z > 0).astype(np.float32)
+        return z > 0
 
     def _sigmoid(self, z):
         """Sigmoid activation function
@@ -76,14 +80,15 @@ class FCLayer:
     def forward(self, x):
         """Implementation of the forward propagation
         Args:
-            x (np.array): array of input data
+            x (np.array): array of input data, kept by reference, so it must
+                not be modified before the backward propagation
         Returns:
             np.array: array of the output layer
         """
         if len(x.shape) > 2:
             self.X = x.reshape(x.shape[0], -1).T
         else:
-            self.X = x.copy()
+            self.X = x
         self.Z = np.dot(self.W, self.X) + self.b
         if self.activation == 'relu':
             A = self._relu(self.Z)
@@ -112,13 +117,7 @@ class FCLayer:
 
     def update_parameters(self, rate, t, beta1=0.9, beta2=0.999, epsilon=1e-8):
         """Update parameters"""
-        self.vW = beta1*self.vW + (1-beta1)*self.dW
-        self.vb = beta1*self.vb + (1-beta1)*self.db
-        self.sW = beta2*self.sW + (1-beta2)*self.dW**2
-        self.sb = beta2*self.sb + (1-beta2)*self.db**2
-        vW = self.vW / (1-beta1**t)
-        vb = self.vb / (1-beta1**t)
-        sW = self.sW / (1-beta2**t)
-        sb = self.sb / (1-beta2**t)
-        self.W -= rate * vW/(np.sqrt(sW)+epsilon)
-        self.b -= rate * vb/(np.sqrt(sb)+epsilon)
+        adam_update(self.W, self.dW, self.vW, self.sW, self._tmpW,
+                    rate, t, beta1, beta2, epsilon)
+        adam_update(self.b, self.db, self.vb, self.sb, self._tmpb,
+                    rate, t, beta1, beta2, epsilon)
@@ -1,5 +1,7 @@
 import numpy as np
-from opt_einsum import contract
+import opt_einsum as oe
+
+from optimizer import adam_update
 
 
 class FullyConnectedLayer:
@@ -23,6 +25,9 @@ class FullyConnectedLayer:
         self.vb = np.zeros(self.b.shape)
         self.sW = np.zeros(self.W.shape)
         self.sb = np.zeros(self.b.shape)
+        self._tmpW = np.zeros(self.W.shape)
+        self._tmpb = np.zeros(self.b.shape)
+        self._exprs = {}
 
     def _init_weights(self, dim_in, dim_out):
         """Initialise parameters with He initialisation.
@@ -42,16 +47,16 @@ class FullyConnectedLayer:
         Returns:
             np.array.
         """
-        return np.maximum(0, z)
+        return z * (z > 0)
 
     def _deriv_relu(self, z):
         """Derivative of ReLu function
         Args:
             z (np.array): input values
         Returns:
-            np.array: derivative at z.
+            np.array: derivative at z as a boolean mask.
         """
-        return np.float64(z > 0)
+        return z > 0
 
     def _sigmoid(self, z):
         """Sigmoid activation function
@@ -71,17 +76,34 @@ class FullyConnectedLayer:
         """
         return np.exp(-z)/(1+np.exp(-z))**2
 
+    def _contract_expressions(self, m):
+        """Contraction expressions of the backward propagation. The optimal
+        path only depends on the shapes, so it is computed once per batch size.
+        Args:
+            m (int): number of examples in the batch
+        Returns:
+            tuple: expressions for dW and dX
+        """
+        if m not in self._exprs:
+            self._exprs[m] = (
+                oe.contract_expression('ij,kj->ik', (self.dim_out, m),
+                                       (self.dim_in, m)),
+                oe.contract_expression('ji,jk->ik', self.W.shape,
+                                       (self.dim_out, m)))
+        return self._exprs[m]
+
     def forward(self, x):
         """Implementation of the forward propagation
         Args:
-            x (np.array): array of input data
+            x (np.array): array of input data, kept by reference, so it must
+                not be modified before the backward propagation
         Returns:
             np.array: array of the output layer
         """
         if len(x.shape) > 2:
             self.X = x.reshape(x.shape[0], -1).T
         else:
-            self.X = x.copy()
+            self.X = x
         self.Z = np.dot(self.W, self.X) + self.b
         if self.activation == 'relu':
             A = self._relu(self.Z)
@@ -101,22 +123,17 @@ class FullyConnectedLayer:
             dZ = dA * self._deriv_relu(self.Z)
         elif self.activation == 'sigmoid':
             dZ = dA * self._deriv_sigmoid(self.Z)
+        dW_expr, dX_expr = self._contract_expressions(m)
         # self.dW = 1/m * np.dot(dZ, self.X.T) + self.lamb / m*self.W
-        self.dW = 1/m * contract('ij,kj->ik', dZ, self.X) + self.lamb/m*self.W
+        self.dW = 1/m * dW_expr(dZ, self.X, backend='numpy') + self.lamb/m*self.W
         self.db = 1/m * np.sum(dZ, axis=1, keepdims=True)
         # dX = np.dot(self.W.T, dZ)
-        dX = contract('ji,jk->ik', self.W, dZ)
+        dX = dX_expr(self.W, dZ, backend='numpy')
         return dX
 
     def update_parameters(self, rate, t, beta1=0.9, beta2=0.999, epsilon=1e-8):
         """Update parameters"""
-        self.vW = beta1*self.vW + (1-beta1)*self.dW
-        self.vb = beta1*self.vb + (1-beta1)*self.db
-        self.sW = beta2*self.sW + (1-beta2)*self.dW**2
-        self.sb = beta2*self.sb + (1-beta2)*self.db**2
-        vW = self.vW / (1-beta1**t)
-        vb = self.vb / (1-beta1**t)
-        sW = self.sW / (1-beta2**t)
-        sb = self.sb / (1-beta2**t)
-        self.W -= rate * vW/(np.sqrt(sW)+epsilon)
-        self.b -= rate * vb/(np.sqrt(sb)+epsilon)
+        adam_update(self.W, self.dW, self.vW, self.sW, self._tmpW,
+                    rate, t, beta1, beta2, epsilon)
+        adam_update(self.b, self.db, self.vb, self.sb, self._tmpb,
+                    rate, t, beta1, beta2, epsilon)
@@ -0,0 +1,31 @@
+def adam_update(P, dP, v, s, tmp, rate, t, beta1=0.9, beta2=0.999,
+                epsilon=1e-8):
+    """In-place Adam update of a parameter. Only uses in-place array
+    operators, so it works for numpy and cupy arrays alike.
+    Args:
+        P (np.array): parameter, updated in place
+        dP (np.array): gradient of the parameter
+        v (np.array): first moment estimate, updated in place
+        s (np.array): second moment estimate, updated in place
+        tmp (np.array): scratch buffer of the shape of P
+        rate (float): learning rate
+        t (int): number of the update step, starting at 1
+    """
+    v *= beta1
+    tmp[...] = dP
+    tmp *= 1-beta1
+    v += tmp
+    s *= beta2
+    tmp[...] = dP
+    tmp *= dP
+    tmp *= 1-beta2
+    s += tmp
+    # rate * v/(1-beta1**t) / (sqrt(s/(1-beta2**t)) + epsilon)
+    tmp[...] = s
+    tmp *= 1/(1-beta2**t)
+    tmp **= 0.5
+    tmp += epsilon
+    tmp **= -1
+    tmp *= v
+    tmp *= rate/(1-beta1**t)
+    P -= tmp
@@ -59,9 +59,9 @@ class PoolLayer:
         Returns:
             np.array: output_values
         """
-        if self.dim_in != x.shape:
+        if self.dim_in != x.shape or self.dX.dtype != x.dtype:
             self.dim_in = x.shape
-            self.dX = np.zeros(self.dim_in)
+            self.dX = np.zeros(self.dim_in, dtype=x.dtype)
         self.X = x
         n_h = self.dim_out[1]
         n_w = self.dim_out[2]
@@ -139,8 +139,14 @@ class PoolLayer:
         M = np.lib.stride_tricks.as_strided(
             self.X, shape=shape, strides=strides)  # , writeable=False)
         # dangerous: writing into memory, don't mess up strides !
+        strides_dX = (self.dX.strides[0],
+                      self.dX.strides[1]*self.stride,
+                      self.dX.strides[2]*self.stride,
+                      self.dX.strides[1],
+                      self.dX.strides[2],
+                      self.dX.strides[3])
         M_dX = np.lib.stride_tricks.as_strided(
-            self.dX, shape=shape, strides=strides)  # , writeable=True)
+            self.dX, shape=shape, strides=strides_dX)  # , writeable=True)
         mask = np.max(M, axis=(-3, -2), keepdims=True) == M
         M_dX += np.multiply(mask, dA[:, :, :, None, None])
         return self.dX
@@ -1,3 +1,4 @@
+import pickle
 import unittest
 import cupy as cp
 import numpy as np
@@ -46,5 +47,153 @@ class TestConvLayer(unittest.TestCase):
         self.assertEqual(l1.db.shape, l2.db.shape)
         self.assertAlmostEqual(np.mean(l1.db), np.mean(l2.db), places=8)
 
+    def test_winograd_forward(self):
+        np.random.seed(1)
+        X = cp.array(np.random.randn(4, 6, 8, 3))
+        l1 = conv_layer.ConvLayer(X.shape, 3, 5, 1, 1, dtype=cp.float64,
+                                  winograd=True)
+        self.assertEqual(l1.forward, l1._forward_winograd3x3)
+        self.assertFalse(conv_layer.ConvLayer(X.shape, 3, 5, 1, 1)._winograd)
+        Z1 = l1.forward(X).copy()
+        Z2 = conv_layer.ConvLayer.forward(l1, X)
+        self.assertEqual(Z1.shape, Z2.shape)
+        self.assertTrue(cp.allclose(Z1, Z2))
+
+    def test_1x1(self):
+        np.random.seed(1)
+        X = cp.array(np.random.randn(4, 5, 6, 3))
+        l1 = conv_layer.ConvLayer(X.shape, 1, 4, 1, 0, dtype=cp.float64)
+        self.assertEqual(l1.forward, l1._forward_1x1)
+        # no im2col buffers are allocated for the 1x1 path
+        self.assertFalse(hasattr(l1, '_L') or hasattr(l1, 'dZ_pad'))
+        l1.b = cp.array(np.random.randn(1, 1, 1, 4))
+        Z1 = l1.forward(X)
+        W_mat = l1.W.reshape(3, 4)
+        Z2 = cp.dot(X.reshape(-1, 3), W_mat).reshape(4, 5, 6, 4) + l1.b
+        Z2 = Z2 * (Z2 > 0)
+        self.assertTrue(cp.allclose(Z1, Z2))
+        dA = cp.array(np.random.randn(*Z2.shape))
+        dX1 = l1.backward(dA)
+        dZ = (dA * (Z2 > 0)).reshape(-1, 4)
+        self.assertTrue(cp.allclose(dX1.reshape(-1, 3), cp.dot(dZ, W_mat.T)))
+        self.assertTrue(cp.allclose(l1.dW.reshape(3, 4),
+                                    cp.dot(X.reshape(-1, 3).T, dZ)))
+        self.assertTrue(cp.allclose(l1.db.reshape(-1), dZ.sum(axis=0)))
+        self.assertTrue(cp.allclose(l1.conv_backward(dA).reshape(-1, 3),
+                                    cp.dot(dZ, W_mat.T)))
+
+    def test_threads(self):
+        np.random.seed(1)
+        X = cp.array(np.random.randn(5, 6, 6, 3))
+        l1 = conv_layer.ConvLayer(X.shape, 2, 4, 2, 1, dtype=cp.float64)
+        l2 = conv_layer.ConvLayer(X.shape, 2, 4, 2, 1, dtype=cp.float64,
+                                  n_threads=2)
+        l2.W = l1.W.copy()
+        Z1 = l1.forward(X)
+        Z2 = l2.forward(X)
+        self.assertTrue(cp.allclose(Z1, Z2))
+        self.assertTrue(cp.allclose(l1.backward(Z1), l2.backward(Z2)))
+        self.assertTrue(cp.allclose(l1.dW, l2.dW))
+        # the layer holds no thread pool, so it can be saved with pickle
+        l3 = pickle.loads(pickle.dumps(l2))
+        self.assertTrue(cp.allclose(l3.forward(X), Z1))
+
+    def test_tiles(self):
+        np.random.seed(1)
+        X = cp.array(np.random.randn(4, 7, 7, 3))
+        l1 = conv_layer.ConvLayer(X.shape, 3, 4, 2, 1, dtype=cp.float64)
+        l2 = conv_layer.ConvLayer(X.shape, 3, 4, 2, 1, dtype=cp.float64,
+                                  tile_bytes=500)
+        l2.W = l1.W.copy()
+        self.assertGreater(len(l2._tiles), X.shape[0])
+        Z1 = l1.forward(X)
+        Z2 = l2.forward(X)
+        self.assertTrue(cp.allclose(Z1, Z2))
+        self.assertTrue(cp.allclose(l1.backward(Z1), l2.backward(Z2)))
+        self.assertTrue(cp.allclose(l1.dW, l2.dW))
+
+    def test_thread_tiles(self):
+        np.random.seed(1)
+        for (m, tile_bytes) in [(4, 10**9), (5, None), (2, None)]:
+            X = cp.array(np.random.randn(m, 6, 6, 3))
+            l1 = conv_layer.ConvLayer(X.shape, 3, 4, 1, 1, dtype=cp.float64)
+            l2 = conv_layer.ConvLayer(X.shape, 3, 4, 1, 1, dtype=cp.float64,
+                                      n_threads=4, tile_bytes=tile_bytes)
+            l2.W = l1.W.copy()
+            # every thread gets at least one tile
+            self.assertGreaterEqual(len(l2._tiles), 4)
+            self.assertEqual(len(l2._L), 4)
+            Z1 = l1.forward(X)
+            Z2 = l2.forward(X)
+            self.assertTrue(cp.allclose(Z1, Z2))
+            self.assertTrue(cp.allclose(l1.backward(Z1), l2.backward(Z2)))
+            self.assertTrue(cp.allclose(l1.dW, l2.dW))
+
+    def test_filter_caches(self):
+        np.random.seed(1)
+        X = cp.array(np.random.randn(2, 6, 6, 3))
+        for winograd in (False, True):
+            l1 = conv_layer.ConvLayer(X.shape, 3, 4, 1, 1, dtype=cp.float64,
+                                      winograd=winograd)
+            l1.backward(l1.forward(X).copy())
+            # the cached filter transforms follow an assignment of W
+            l1.W = cp.array(np.random.randn(*l1.W.shape))
+            l2 = conv_layer.ConvLayer(X.shape, 3, 4, 1, 1, dtype=cp.float64)
+            l2.W = l1.W.copy()
+            Z1 = l1.forward(X).copy()
+            self.assertTrue(cp.allclose(Z1, l2.forward(X)))
+            self.assertTrue(cp.allclose(l1.backward(Z1), l2.backward(l2.Z)))
+            # and an update of the parameters
+            l1.update_parameters(0.1, 1)
+            l2.W = l1.W.copy()
+            l2.b = l1.b.copy()
+            Z1 = l1.forward(X).copy()
+            self.assertTrue(cp.allclose(Z1, l2.forward(X)))
+            self.assertTrue(cp.allclose(l1.backward(Z1), l2.backward(l2.Z)))
+
+    def test_pickle(self):
+        np.random.seed(1)
+        X = cp.array(np.random.randn(2, 7, 7, 3))
+        l1 = conv_layer.ConvLayer(X.shape, 3, 4, 2, 1, dtype=cp.float64)
+        l2 = pickle.loads(pickle.dumps(l1))
+        Z1 = l1.forward(X)
+        Z2 = l2.forward(X)
+        self.assertTrue(cp.allclose(Z1, Z2))
+        self.assertTrue(cp.allclose(l1.backward(Z1), l2.backward(Z2)))
+        self.assertTrue(cp.allclose(l1.dW, l2.dW))
+
+    def test_im2col(self):
+        np.random.seed(1)
+        X = cp.array(np.random.randn(2, 5, 5, 3))
+        L = conv_layer.im2col_hwc(X, 3, 2)
+        self.assertEqual(L.shape, (2*2*2, 3*3*3))
+        self.assertTrue((L[3] == X[0, 2:5, 2:5, :].reshape(-1)).all())
+        dX = conv_layer.col2im_add(cp.ones(L.shape), 3, 2, cp.zeros(X.shape))
+        self.assertEqual(float(dX[0, 2, 2, 0]), 4.0)
+        self.assertEqual(float(dX[1, 0, 1, 2]), 1.0)
+
+    def test_float32_backward_propagation(self):
+        np.random.seed(1)
+        X = cp.array(np.random.randn(2, 5, 5, 2), dtype=cp.float32)
+        l1 = conv_layer.ConvLayer(X.shape, 3, 3, 1, 1)
+        l1.forward(X)
+        dX = l1.backward(cp.ones(l1.dim_out))
+        self.assertEqual(dX.dtype, cp.float32)
+        self.assertEqual(l1.dW.dtype, cp.float32)
+
     def test_update_parameters(self):
-        pass
+        np.random.seed(1)
+        l1 = conv_layer.ConvLayer((2, 5, 5, 3), 3, 4, 1, 1, dtype=cp.float64)
+        W = l1.W.copy()
+        vW = cp.zeros(W.shape)
+        sW = cp.zeros(W.shape)
+        for t in range(1, 4):
+            dW = cp.array(np.random.randn(*W.shape))
+            l1.dW[:, :, :, :] = dW
+            l1.update_parameters(0.01, t)
+            # allocating Adam update
+            vW = 0.9*vW + 0.1*dW
+            sW = 0.999*sW + 0.001*dW**2
+            W = W - 0.01*(vW/(1-0.9**t))/(cp.sqrt(sW/(1-0.999**t))+1e-8)
+            self.assertTrue(cp.allclose(l1.vW, vW, rtol=1e-12, atol=1e-14))
+            self.assertTrue(cp.allclose(l1.W, W, rtol=1e-12, atol=1e-14))
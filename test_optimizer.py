@@ -0,0 +1,48 @@
+import unittest
+import numpy as np
+
+from optimizer import adam_update
+from layer import FullyConnectedLayer
+
+
+def adam_reference(P, dP, v, s, rate, t, beta1=0.9, beta2=0.999,
+                   epsilon=1e-8):
+    """Allocating Adam update the layers used before adam_update."""
+    v = beta1*v + (1-beta1)*dP
+    s = beta2*s + (1-beta2)*dP**2
+    P = P - rate * (v/(1-beta1**t))/(np.sqrt(s/(1-beta2**t))+epsilon)
+    return P, v, s
+
+
+class TestOptimizer(unittest.TestCase):
+    def test_adam_update(self):
+        np.random.seed(1)
+        P = np.random.randn(3, 4)
+        v = np.zeros(P.shape)
+        s = np.zeros(P.shape)
+        P_ref, v_ref, s_ref = P.copy(), v.copy(), s.copy()
+        tmp = np.zeros(P.shape)
+        for t in range(1, 5):
+            dP = np.random.randn(*P.shape)
+            adam_update(P, dP, v, s, tmp, 0.01, t)
+            P_ref, v_ref, s_ref = adam_reference(P_ref, dP, v_ref, s_ref,
+                                                 0.01, t)
+            self.assertTrue(np.allclose(P, P_ref, rtol=1e-12, atol=1e-14))
+            self.assertTrue(np.allclose(v, v_ref, rtol=1e-12, atol=1e-14))
+            self.assertTrue(np.allclose(s, s_ref, rtol=1e-12, atol=1e-14))
+
+    def test_fully_connected_update_parameters(self):
+        np.random.seed(2)
+        l1 = FullyConnectedLayer(3, 2)
+        W, b = l1.W.copy(), l1.b.copy()
+        vW, sW = np.zeros(W.shape), np.zeros(W.shape)
+        vb, sb = np.zeros(b.shape), np.zeros(b.shape)
+        for t in range(1, 4):
+            l1.dW = np.random.randn(*W.shape)
+            l1.db = np.random.randn(*b.shape)
+            l1.update_parameters(0.01, t)
+            W, vW, sW = adam_reference(W, l1.dW, vW, sW, 0.01, t)
+            b, vb, sb = adam_reference(b, l1.db, vb, sb, 0.01, t)
+            self.assertTrue(np.allclose(l1.W, W, rtol=1e-12, atol=1e-14))
+            self.assertTrue(np.allclose(l1.b, b, rtol=1e-12, atol=1e-14))
+            self.assertTrue(np.allclose(l1.sW, sW, rtol=1e-12, atol=1e-14))
@@ -3,6 +3,7 @@ import cupy as cp
 
 
 from pool_layer import PoolLayer
+from conv_layer import ConvLayer
 
 
 class TestPoolLayer(unittest.TestCase):
@@ -24,3 +25,17 @@ class TestPoolLayer(unittest.TestCase):
         dX2 = L.backward(dA)
         self.assertEqual(dX1.shape, dX2.shape)
         self.assertTrue((dX1 == dX2).all())
+
+    def test_float32_backward_propagation(self):
+        X = cp.random.rand(2, 7, 7, 1)
+        C = ConvLayer(X.shape, 3, 3, 1, 0, activation='relu')
+        A = C.forward(X.astype(cp.float32))
+        L1 = PoolLayer(C.dim_out, f=2, stride=2, mode='max')
+        L2 = PoolLayer(C.dim_out, f=2, stride=2, mode='max')
+        dA = cp.ones(L1.dim_out)
+        L1.forward(A)
+        dX1 = L1.backward(dA)
+        L2.forward(A.astype(cp.float64))
+        dX2 = L2.backward(dA)
+        self.assertEqual(dX1.dtype, A.dtype)
+        self.assertTrue((dX1 == dX2).all())